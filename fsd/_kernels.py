@@ -0,0 +1,56 @@
+"""Numeric kernels for the hot paths of the experiments. These are JIT-compiled with numba when it is installed,
+otherwise the plain numpy versions are used."""
+import math
+
+import numpy as np
+from scipy import stats
+
+try:
+    from numba import njit, prange
+except ImportError:
+    njit = None
+
+NUMBA_AVAILABLE = njit is not None
+
+
+def _copula_uniforms_numpy(X):
+    """Standardizes each feature of each draw in X, shape (n_draws, n_samples, n_features), and maps it through the
+    standard normal CDF"""
+    Z = (X - X.mean(axis=1, keepdims=True)) / np.std(X, axis=1, keepdims=True)  # z = (x - mu_x) / \sigma_x
+    return stats.norm.cdf(Z)
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, parallel=True)
+    def _copula_uniforms_numba(X):
+        """Standardizes each feature of each draw in X, shape (n_draws, n_samples, n_features), and maps it through
+        the standard normal CDF"""
+        n_draws, n_samples, n_features = X.shape
+        U = np.empty_like(X)
+        for flat_idx in prange(n_draws * n_features):
+            draw_idx, feature_idx = flat_idx // n_features, flat_idx % n_features
+            mean = X[draw_idx, :, feature_idx].mean()
+            std = np.sqrt(((X[draw_idx, :, feature_idx] - mean)**2).mean())
+            for sample_idx in range(n_samples):
+                z = (X[draw_idx, sample_idx, feature_idx] - mean) / std
+                U[draw_idx, sample_idx, feature_idx] = 0.5 * math.erfc(-z / math.sqrt(2.0))  # Phi(z)
+        return U
+
+    _copula_uniforms = _copula_uniforms_numba
+else:
+    _copula_uniforms = _copula_uniforms_numpy
+
+
+def copula_uniforms(X):
+    """Standardizes each feature of X and maps it through the standard normal CDF. X is either a single draw of
+    shape (n_samples, n_features) or a batch of draws of shape (n_draws, n_samples, n_features), in which case each
+    draw is standardized separately"""
+    if X.ndim == 2:
+        return _copula_uniforms(X[np.newaxis])[0]
+    return _copula_uniforms(X)
+
+
+def warmup():
+    """Calls each kernel once on a tiny input so numba compiles (or loads from its cache) before any timing starts"""
+    X = np.random.RandomState(0).standard_normal(size=(4, 2))
+    copula_uniforms(X)
@@ -0,0 +1,17 @@
+import numpy as np
+from sklearn.utils import check_random_state as sklearn_check_random_state
+
+
+def check_random_state(seed):
+    """Turns seed into a random number generator. This is sklearn.utils.check_random_state, except that
+    np.random.Generator instances (e.g. from np.random.default_rng) are also accepted and returned as is"""
+    if isinstance(seed, np.random.Generator):
+        return seed
+    return sklearn_check_random_state(seed)
+
+
+def random_integers(rng, low, high=None, size=None):
+    """Draws random integers in [low, high) from either a RandomState (randint) or a Generator (integers)"""
+    if isinstance(rng, np.random.Generator):
+        return rng.integers(low, high, size=size)
+    return rng.randint(low, high, size=size)
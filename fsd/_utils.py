@@ -1,7 +1,7 @@
 from textwrap import wrap as textwrap
+import pickle
 
 import numpy as np
-from sklearn.utils import check_random_state
 import seaborn as sn
 import matplotlib.pyplot as plt
 from sklearn.metrics import confusion_matrix as sklearn_confusion_matrix
@@ -9,6 +9,9 @@ import networkx as nx
 import scipy.optimize
 from scipy import stats
 
+from fsd._kernels import copula_uniforms
+from fsd._random import check_random_state
+
 def marginal_attack(X, attack_set, random_state=None):
     """Performs marginal attack jointly on the features in attack_set"""
     rng = check_random_state(random_state)
@@ -97,16 +100,19 @@ def create_graphical_model(sqrtn=2, kind='complete',
                 mutual_information_of_attack=mutual_information(cov), condition_number=np.linalg.cond(cov))
 
 
-def sim_copula_data(p_size, q_size, mean, cov, a, b, rng=None):
-    """ Takes in a target Gaussian mean and covariance, then transforms to a copula """
+def sim_copula_data(p_size, q_size, mean, cov, a, b, rng=None, chol=None, n_draws=None):
+    """ Takes in a target Gaussian mean and covariance (or its Cholesky factor), then transforms to a copula """
     if rng is None:
         rng = np.random.RandomState(np.random.randint(10000))
-    X = rng.multivariate_normal(mean=mean, cov=cov, size=p_size+q_size)
-    Z = (X - X.mean(axis=0)) / np.std(X, axis=0)  # z = (x - mu_x) / \sigma_x
-    U = stats.norm.cdf(Z)  # fits to copula, j-dist r.v. with uniform marginals
+    size = (p_size+q_size,) if n_draws is None else (n_draws, p_size+q_size)
+    if chol is None:
+        X = rng.multivariate_normal(mean=mean, cov=cov, size=size)
+    else:
+        X = mean + rng.standard_normal(size=size + (chol.shape[0],)) @ chol.T
+    U = copula_uniforms(X)  # standardizes then fits to copula, j-dist r.v. with uniform marginals
     B = stats.beta.ppf(U, a=a, b=b)  # inverse CDF (percent point function)
 
-    return B[:p_size], B[p_size:]  # returns samples p and q
+    return B[..., :p_size, :], B[..., p_size:, :]  # returns samples p and q
 
 
 def get_detection_metrics(true_labels, predicted_labels):
@@ -136,6 +142,29 @@ def get_localization_metrics(true_labels_tensor, predicted_labels_tensor, n_dim)
             'confusion_tensor': confusion_tensor}
 
 
+def load_experiment_results(file_name, legacy_layout=False):
+    """Reads the records appended to file_name into a dictionary, with the other scripts' arrays if legacy_layout"""
+    experiment_results_dict = dict()
+    with open(file_name, 'rb') as f:
+        while True:
+            try:
+                experiment_name, experiment_results = pickle.load(f)
+            except EOFError:
+                break
+            if legacy_layout and 'attack_flags' in experiment_results:
+                # channels are [attacked, localized, score] for each feature and test
+                experiment_results['localization_results'] = \
+                    np.stack((experiment_results['attack_flags'], experiment_results['localized_flags'],
+                              experiment_results['feature_scores']), axis=-1).astype(float)
+            if legacy_layout and 'shift_flags' in experiment_results:
+                # channels are [shifted, detected] for each test
+                experiment_results['detection_results'] = \
+                    np.stack((experiment_results['shift_flags'], experiment_results['detected_flags']),
+                             axis=-1).astype(float)
+            experiment_results_dict[experiment_name] = experiment_results
+    return experiment_results_dict
+
+
 def plot_confusion_matrix(confusion_matrix, plot=False, title=None, axis=None, filename=None):
     """Plots as confusion matrix using seaborn heatmap"""
     if axis is None:
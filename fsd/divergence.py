@@ -2,9 +2,11 @@
 from copy import copy
 # external
 import numpy as np
-from sklearn.utils import check_array, check_random_state
+from sklearn.utils import check_array
 from scipy.stats import ks_2samp as ks_stat
 
+from fsd._random import check_random_state
+
 class FisherDivergence:
     """
     A class for computing the conditional Fisher divergence for two densities.
@@ -58,9 +60,9 @@ class FisherDivergence:
 
         Parameters
         ----------
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
         Returns
         -------
@@ -69,8 +71,8 @@ class FisherDivergence:
         self._check_fitted()
         rng = check_random_state(random_state)
         # creating an array of samples from both p_hat and q_hat
-        samples = np.concatenate((self.p_hat_.sample(self.n_expectation),
-                                 self.q_hat_.sample(self.n_expectation)), axis=0)
+        samples = np.concatenate((self.p_hat_.sample(self.n_expectation, random_state=rng),
+                                 self.q_hat_.sample(self.n_expectation, random_state=rng)), axis=0)
         # getting the gradient of the log probability of those samples under p_hat and q_hat
         p_grad_log_prob = self.p_hat_.gradient_log_prob(samples)
         q_grad_log_prob = self.q_hat_.gradient_log_prob(samples)
@@ -107,9 +109,9 @@ class ModelKS(FisherDivergence):
         ----------
         n_samples: int,
             The number of samples used to create the empirical distribution for each density
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
 
         Returns
@@ -119,8 +121,8 @@ class ModelKS(FisherDivergence):
         """
         self._check_fitted()
         rng = check_random_state(random_state)
-        samples = np.concatenate((self.p_hat_.sample(self.n_expectation),
-                                  self.q_hat_.sample(self.n_expectation)), axis=0)
+        samples = np.concatenate((self.p_hat_.sample(self.n_expectation, random_state=rng),
+                                  self.q_hat_.sample(self.n_expectation, random_state=rng)), axis=0)
         running_KS_divergence = np.zeros(shape=(samples.shape[1],))
         for sample in samples:
             for j_to_condition_on in range(sample.shape[0]):
@@ -184,9 +186,9 @@ class KnnKS:
 
         Parameters
         ----------
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
 
         Returns
@@ -1,5 +1,7 @@
 import numpy as np
-from sklearn.utils import check_array, check_random_state
+from sklearn.utils import check_array
+
+from fsd._random import check_random_state, random_integers
 
 
 class FeatureShiftDetector:
@@ -74,9 +76,9 @@ class FeatureShiftDetector:
         Y : array-like, shape (n_samples, n_features)
             An empirical distribution of samples from the query distribution, i.e. the distribution we want to know if
             it has shifted away from the reference distribution
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
         return_scores: bool, optional (default=False)
             If return_scores is True, then the scores of each features will be returned. The default is False.
@@ -160,7 +162,7 @@ class FeatureShiftDetector:
             concatenated_distribution = X_boot.copy()
 
         bootstrap_split_range = [self.n_window_samples, concatenated_distribution.shape[0] - self.n_window_samples]
-        bootstrap_split_idxs = rng.randint(*bootstrap_split_range, size=self.n_bootstrap_samples)
+        bootstrap_split_idxs = random_integers(rng, *bootstrap_split_range, size=self.n_bootstrap_samples)
         for B_idx, bootstrap_split in enumerate(bootstrap_split_idxs):
             XY = concatenated_distribution[bootstrap_split-self.n_window_samples: bootstrap_split+self.n_window_samples]
             if self.data_transform is None:
@@ -1,10 +1,12 @@
 import numpy as np
+from scipy.linalg import cho_factor, cho_solve
 import torch
 from torch.distributions.multivariate_normal import MultivariateNormal
 from sklearn.neighbors import NearestNeighbors
-from sklearn.utils import check_array, check_random_state
+from sklearn.utils import check_array
 
 from fsd._deep_density_model import SingleGaussianizeStep, TorchUnitHistogram
+from fsd._random import check_random_state, random_integers
 
 
 class GaussianDensity:
@@ -60,9 +62,9 @@ class GaussianDensity:
         ----------
         n_samples: int, optional (default=1)
             Number of samples to generate.
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
 
         Returns
@@ -73,7 +75,7 @@ class GaussianDensity:
 
         self._check_fitted('The density must be fitted before it can be sampled')
         rng = check_random_state(random_state)
-        torch.manual_seed(rng.randint(10000))  # sets the torch seed using the rng from numpy
+        torch.manual_seed(int(random_integers(rng, 10000)))  # sets the torch seed using the rng from numpy
         return self.density_.sample((n_samples,)).numpy()
 
     def conditional_sample(self, x, feature_idx, n_samples=1, random_state=None):
@@ -89,9 +91,9 @@ class GaussianDensity:
             The index of the feature which we will compute the conditional distribution of (i.e. p(x_j | x_{-j})) 
         n_samples: int, optional (default=1)
             The number of sample to sample from the conditional distribution
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
 
         Returns
@@ -122,19 +124,12 @@ class GaussianDensity:
         gradient-log-probability: array-like (n_samples, n_features)
             The gradient of the log probability of each sample"""
 
-        # TODO: see if we can speed this up and perform the gradient on
-        #  all the samples at once rather than one at a time
         self._check_fitted("The density must be fitted before sample probabilities can be taken")
         X = check_array(X,  ensure_2d=False, dtype=np.float)
         if X.ndim == 1:
             X = X.reshape(1, -1)
-        grad_log_probs = np.empty_like(X)
-        X = torch.from_numpy(X)
-        for sample_idx, sample in enumerate(X):  # iterating over each sample to calc the gradient of the log prob.
-            sample.requires_grad_(True)
-            log_prob = self.density_.log_prob(sample)
-            grad_log_probs[sample_idx] = torch.autograd.grad(log_prob, sample)[0]  # returns tuple with [0] as grad
-        return grad_log_probs
+        # the gradient of the Gaussian log probability has the closed form -Sigma^{-1} (x - mu), solved for all samples
+        return -cho_solve(cho_factor(self.covariance_, lower=True), (X - self.mean_).T).T
 
     def log_prob(self, X):
         """
@@ -260,9 +255,9 @@ class DeepDensity:
         ----------
         n_samples: int, optional (default=1)
             Number of samples to generate.
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
 
         Returns
@@ -272,7 +267,7 @@ class DeepDensity:
         """
         self._check_fitted()
         rng = check_random_state(random_state)
-        torch.manual_seed(rng.randint(1000))
+        torch.manual_seed(int(random_integers(rng, 1000)))
         if n_samples == 1:
             ravel = True
         else:
@@ -395,9 +390,9 @@ class Knn:
         n_samples : int
             The number of samples to be drawn from the training data, If with_replacement is False, then n_samples must
              be less than the number of training samples
-        random_state: int, RandomState instance, or None, optional (default=None)
+        random_state: int, RandomState or Generator instance, or None, optional (default=None)
             If int, then the random state is set using np.random.RandomState(int),
-            if RandomState instance, then the instance is used directly, if None then a RandomState instance is
+            if RandomState or Generator instance, then it is used directly, if None then a RandomState instance is
             used as if np.random() was called
         with_replacement : bool
             If true, sampling is performed with replacement, and if false then without.
@@ -1,15 +1,26 @@
+import os
+# the sweep is parallelized across processes, so each worker only gets a single BLAS/OpenMP thread
+os.environ['OPENBLAS_NUM_THREADS'] = '1'
+os.environ['MKL_NUM_THREADS'] = '1'
+os.environ['OMP_NUM_THREADS'] = '1'
+os.environ['NUMBA_NUM_THREADS'] = '1'
 import sys
+import hashlib
 from warnings import warn
 from time import time
 from os import path
+from itertools import product
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import pickle
+from joblib.externals.loky import get_reusable_executor
 
 sys.path.append('..')
 from fsd import FeatureShiftDetector
 from fsd.divergence import ModelKS, KnnKS, FisherDivergence
 from fsd.models import GaussianDensity, Knn
+from fsd import _kernels
 from fsd._utils import marginal_attack, create_graphical_model, sim_copula_data,\
                        get_detection_metrics, get_localization_metrics, plot_confusion_matrix, get_confusion_tensor
 
@@ -29,99 +40,188 @@ mi_list = [0.2, 0.1, 0.05, 0.01]
 graph_type_list = ['complete', 'grid', 'cycle', 'random']
 experiment_list = ['MB-SM', 'MB-KS']
 n_attacked_sensors_list = [2, 3, 4, 5]
+n_workers = os.cpu_count() or 1  # the number of processes the experiment sweep is spread across
+use_bootstrap_cache = False  # if True, reuses the bootstrap thresholds of a previous run with the same settings
+bootstrap_cache_version = 4  # bump when the score computation changes
+results_dir = path.join('..', 'results')
+bootstrap_cache_dir = path.join(results_dir, 'cache')
 
-experiment_results_dict = dict()  # the dictionary of results per experiment_graphtype_mi
-for n_compromised in n_attacked_sensors_list:
-    for experiment in experiment_list:
-        for graph_type in graph_type_list:
-            for mi in mi_list:
-                localization_results_across_seeds = []
-                detection_results_across_seeds = []
-                test_time_list = []
-                for random_seed in random_seed_list:
-                    # Setting up specific experiment information
-                    rng = np.random.RandomState(random_seed)
-                    print(f'Starting: {experiment} on {graph_type} graph with {n_compromised} compromised sensors, ' +
-                          f'{mi} MI, and {random_seed} as the random seed')
-                    graph = create_graphical_model(sqrtn=sqrtn, kind=graph_type, target_mutual_information=mi,
-                                                   random_seed=random_seed, target_idx='auto')
-                    if experiment == 'MB-SM':
-                        model = GaussianDensity()
-                        statistic = FisherDivergence(model, n_expectation=n_expectation)
-                    elif experiment == 'MB-KS':
-                        model = GaussianDensity()
-                        statistic = ModelKS(model, n_expectation=n_expectation)
-                    # Localization results are [did attack happen, was it localized, the test score] for each feature
-                    localization_results = np.zeros(shape=(n_dim, n_attacks*2, 3))
-                    # Detection results are [did a shift happen, was it detected]
-                    detection_results = np.zeros(shape=(n_attacks*2, 2))
-                    # Setting up attack data
-                    random_feature_idxs = np.zeros(shape=(n_attacks*2, n_compromised))
-                    for i in range(n_attacks*2):
-                        random_feature_idxs[i] = rng.choice(n_dim, size=n_compromised, replace=False)
-                    for test_idx, features in enumerate(random_feature_idxs[:n_attacks]):
-                        localization_results[features, test_idx, 0] = 1  # recording if attacks happen for each test
-                        detection_results[test_idx, 0] = 1
-                    # Setting up FeatureShiftDetector
-                    fsd = FeatureShiftDetector(statistic, bootstrap_method='simple',
-                                               n_bootstrap_samples=n_bootstrap_runs,
-                                               significance_level=alpha, n_compromised=n_compromised)
-                    # since we are using data always drawn from the same distribution we only need to fit once
-                    X_boot, Y_boot = sim_copula_data(n_samples, n_samples, mean=np.zeros(shape=sqrtn ** 2),
-                                           cov=graph['cov'], a=a, b=b, rng=rng)
-                    fsd.fit(X_boot, Y_boot)  # sets the detection threshold for us.
-                    # beginning testing
-                    for test_idx in range(n_attacks*2):
-                        X_test, Y_test = sim_copula_data(n_samples, n_samples, mean=np.zeros(shape=sqrtn**2),
-                                               cov=graph['cov'], a=a, b=b, rng=rng)
-                        start = time()  # does not start earlier so time for data generatation is not taken into account
-                        if detection_results[test_idx, 0]:  # if attack
-                            j_attacked = random_feature_idxs[test_idx]  # here j_attacked is a set of features
-                            Y_test = marginal_attack(Y_test, j_attacked)
-                        detection, attacked_features, scores = \
-                            fsd.detect_and_localize(X_test, Y_test, random_state=rng, return_scores=True)
-                        localization_results[:, test_idx, 2] = scores
-                        detection_results[test_idx, 1] = detection
-                        if detection:  # if a distribution shift is detected, record localization results
-                            localization_results[attacked_features, test_idx, 1] = 1
-                        test_time_list.append(time() - start)
-                    # recording testing results for seed
-                    localization_results_across_seeds.append(localization_results.copy())
-                    detection_results_across_seeds.append(detection_results.copy())
 
-                # recording time per test across seeds
-                time_per_test = np.array(test_time_list).mean()
-                print(f'Time per test: {time_per_test:.4f} sec')
-                # recording detection results across seeds
-                detection_results = np.concatenate(detection_results_across_seeds, axis=0)
-                detection_metrics = get_detection_metrics(true_labels=detection_results[:, 0],
-                                                       predicted_labels=detection_results[:, 1])
-                print('Detection results:')
-                print(f'Precision: {detection_metrics["precision"]:.3f};' +
-                      f' Recall: {detection_metrics["recall"]:.3f}')
-                # recording localization results across seeds
-                localization_results = np.concatenate(localization_results_across_seeds, axis=1)  # combines seed results
-                localization_metrics = get_localization_metrics(localization_results[:, :, 0],
-                                                                localization_results[:, :, 1], n_dim=n_dim)
-                print('Localization results:')
-                print(f'Micro-precision: {localization_metrics["micro-precision"]:.3f};' +
-                      f' Micro-recall: {localization_metrics["micro-recall"]:.3f}')
-                # ploting detection confusion matrix
-                plot_title = f'Detection for {experiment} on {graph_type} graph with {mi} MI'
-                # Uncomment below if you would like a detection confusion matrix plotted for each experiment
-                # plot_confusion_matrix(detection_metrics["confusion_matrix"],
-                #                       title=plot_title, plot=True)  # plots cm
-                # saving results
-                experiment_results = {
-                    'detection_results': detection_results,
-                    'detection_metrics': detection_metrics,
-                    'localization_results': localization_results,
-                    'localization_metrics': localization_metrics,
-                    'time': np.array(test_time_list)
-                }
-                experiment_name = f'{experiment}_{graph_type}_{mi}_with_{n_compromised}_attacked'
-                experiment_results_dict[experiment_name] = experiment_results
-                experiment_save_name = path.join('..', 'results', 'unknown-multiple-sensors-dict.pickle')
-                pickle.dump(experiment_results_dict, open(experiment_save_name, 'wb'))
-                print()
-print('Fin!')
+def fit_with_cache(fsd, X_boot, Y_boot, cache_name, random_state=None):
+    """Fits fsd on X_boot and Y_boot, unless its fitted thresholds have already been cached under cache_name"""
+    cache_file = path.join(bootstrap_cache_dir, f'{cache_name}.pickle')
+    if use_bootstrap_cache and path.exists(cache_file):
+        with open(cache_file, 'rb') as f:
+            fsd.detection_thresholds_, fsd.localization_thresholds_, fsd.bootstrap_score_distribution_ = \
+                pickle.load(f)
+        return fsd
+    fsd.fit(X_boot, Y_boot, random_state=random_state)
+    if use_bootstrap_cache:
+        os.makedirs(bootstrap_cache_dir, exist_ok=True)
+        # written to a temporary file first since other workers may be fitting (and saving) the same entry
+        tmp_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(tmp_file, 'wb') as f:
+            pickle.dump((fsd.detection_thresholds_, fsd.localization_thresholds_,
+                         fsd.bootstrap_score_distribution_), f)
+        os.replace(tmp_file, cache_file)
+    return fsd
+
+
+def run_seed(experiment, graph_type, mi, random_seed):
+    """Runs every test of one experiment configuration and seed, returning the results for each n_compromised"""
+    _kernels.warmup()  # compiles the numba kernels (if available) so compilation is never timed
+    # Setting up specific experiment information
+    rng = np.random.default_rng(random_seed)
+    print(f'Starting: {experiment} on {graph_type} graph with {mi} MI, and {random_seed} as the random seed')
+    graph = create_graphical_model(sqrtn=sqrtn, kind=graph_type, target_mutual_information=mi,
+                                   random_seed=random_seed, target_idx='auto')
+    chol = np.linalg.cholesky(graph['cov'])  # factorized once since every draw below uses the same covariance
+    if experiment == 'MB-SM':
+        model = GaussianDensity()
+        statistic = FisherDivergence(model, n_expectation=n_expectation)
+    elif experiment == 'MB-KS':
+        model = GaussianDensity()
+        statistic = ModelKS(model, n_expectation=n_expectation)
+    # Setting up FeatureShiftDetector, n_compromised is only used when localizing so it is set per test set below
+    fsd = FeatureShiftDetector(statistic, bootstrap_method='simple',
+                               n_bootstrap_samples=n_bootstrap_runs,
+                               significance_level=alpha)
+    # the first pair is for bootstrapping, the rest are the clean test pairs
+    X_data, Y_data = sim_copula_data(n_samples, n_samples, mean=np.zeros(shape=sqrtn**2),
+                                     cov=graph['cov'], a=a, b=b, rng=rng, chol=chol, n_draws=n_attacks + 1)
+    X_boot, Y_boot = X_data[0], Y_data[0]
+    X_pool, Y_pool = X_data[1:], Y_data[1:]
+    # since we are using data always drawn from the same distribution we only need to fit once
+    boot_params = (bootstrap_cache_version, experiment, graph_type, mi, random_seed, n_samples, n_bootstrap_runs,
+                   n_expectation, alpha, a, b, sqrtn, n_attacks + 1, _kernels.NUMBA_AVAILABLE)
+    boot_hash = hashlib.sha1(repr(boot_params).encode())
+    boot_hash.update(X_boot.tobytes())
+    boot_hash.update(Y_boot.tobytes())
+    cache_name = f'{experiment}_{graph_type}_{mi}_seed_{random_seed}_' + boot_hash.hexdigest()[:12]
+    # the bootstrap gets its own generator so later draws do not depend on the cache
+    fit_with_cache(fsd, X_boot, Y_boot, cache_name,
+                   random_state=np.random.default_rng(rng.integers(2**32)))  # sets the detection threshold for us.
+    # releases the densities fit to the last bootstrap sample
+    fsd.statistic.p_hat_, fsd.statistic.q_hat_ = None, None
+
+    compromised_results = dict()
+    for n_compromised in n_attacked_sensors_list:
+        fsd.n_compromised = n_compromised
+        # Localization results are, for each feature and test, did an attack happen, was it localized, and the score
+        attack_flags = np.zeros(shape=(n_dim, n_attacks*2), dtype=np.uint8)
+        localized_flags = np.zeros_like(attack_flags)
+        feature_scores = np.zeros(shape=(n_dim, n_attacks*2), dtype=np.float32)
+        # Detection results are, for each test, did a shift happen and was it detected
+        shift_flags = np.zeros(shape=(n_attacks*2,), dtype=np.uint8)
+        detected_flags = np.zeros_like(shift_flags)
+        # Setting up attack data
+        # the n_compromised smallest of n_dim uniform draws per row is a sample of features without replacement
+        random_feature_idxs = np.argpartition(rng.random((n_attacks*2, n_dim)), n_compromised - 1,
+                                              axis=1)[:, :n_compromised]
+        # recording if attacks happen for each test, where the first n_attacks tests are the attacked ones
+        attacked_tests = np.repeat(np.arange(n_attacks), n_compromised)
+        attack_flags[random_feature_idxs[:n_attacks].ravel(), attacked_tests] = 1
+        shift_flags[:n_attacks] = 1
+        # beginning testing, where test test_idx uses the clean pair test_idx % n_attacks
+        test_times = np.empty(n_attacks*2, dtype=np.float64)
+        for test_idx in range(n_attacks*2):
+            X_test, Y_test = X_pool[test_idx % n_attacks], Y_pool[test_idx % n_attacks]
+            start = time()  # does not start earlier so time for data generatation is not taken into account
+            if shift_flags[test_idx]:
+                j_attacked = random_feature_idxs[test_idx]  # here j_attacked is a set of features
+                Y_test = marginal_attack(Y_test, j_attacked, random_state=rng)
+            detection, attacked_features, scores = fsd.detect_and_localize(X_test, Y_test, random_state=rng,
+                                                                           return_scores=True)
+            feature_scores[:, test_idx] = scores
+            detected_flags[test_idx] = detection
+            if detection:  # if a distribution shift is detected, record localization results
+                localized_flags[attacked_features, test_idx] = 1
+            test_times[test_idx] = time() - start
+        # every result has the tests as its last axis
+        compromised_results[n_compromised] = dict(attack_flags=attack_flags, localized_flags=localized_flags,
+                                                  feature_scores=feature_scores, shift_flags=shift_flags,
+                                                  detected_flags=detected_flags, test_times=test_times)
+    return compromised_results
+
+
+def save_experiment_results(experiment, graph_type, mi, n_compromised, seed_results, results_file):
+    """Combines the results of an experiment across seeds, prints its metrics and appends them to results_file"""
+    experiment_name = f'{experiment}_{graph_type}_{mi}_with_{n_compromised}_attacked'
+    results = combine_seed_results(seed_results)
+    test_times = results['test_times']
+    print(f'Finished: {experiment} on {graph_type} graph with {n_compromised} compromised sensors ' +
+          f'and {mi} MI')
+    # recording time per test across seeds
+    time_per_test = test_times.mean()
+    print(f'Time per test: {time_per_test:.4f} sec')
+    # recording detection results across seeds
+    detection_metrics = get_detection_metrics(true_labels=results['shift_flags'],
+                                              predicted_labels=results['detected_flags'])
+    print('Detection results:')
+    print(f'Precision: {detection_metrics["precision"]:.3f};' +
+          f' Recall: {detection_metrics["recall"]:.3f}')
+    # recording localization results across seeds
+    localization_metrics = get_localization_metrics(results['attack_flags'], results['localized_flags'],
+                                                    n_dim=n_dim)
+    print('Localization results:')
+    print(f'Micro-precision: {localization_metrics["micro-precision"]:.3f};' +
+          f' Micro-recall: {localization_metrics["micro-recall"]:.3f}')
+    # ploting detection confusion matrix
+    plot_title = f'Detection for {experiment} on {graph_type} graph with {mi} MI'
+    # Uncomment below if you would like a detection confusion matrix plotted for each experiment
+    # plot_confusion_matrix(detection_metrics["confusion_matrix"],
+    #                       title=plot_title, plot=True)  # plots cm
+    # saving results
+    experiment_results = {
+        'shift_flags': results['shift_flags'],
+        'detected_flags': results['detected_flags'],
+        'detection_metrics': detection_metrics,
+        'attack_flags': results['attack_flags'],
+        'localized_flags': results['localized_flags'],
+        'feature_scores': results['feature_scores'],
+        'localization_metrics': localization_metrics,
+        'time': test_times
+    }
+    pickle.dump((experiment_name, experiment_results), results_file)
+    results_file.flush()
+    print()
+
+
+def combine_seed_results(seed_results):
+    """Combines the results of each seed, in the order of random_seed_list, into (..., n_seeds*n_tests) arrays"""
+    n_seeds, n_tests = len(seed_results), n_attacks*2
+    buffers = dict(attack_flags=np.zeros(shape=(n_dim, n_seeds, n_tests), dtype=np.uint8),
+                   localized_flags=np.zeros(shape=(n_dim, n_seeds, n_tests), dtype=np.uint8),
+                   feature_scores=np.zeros(shape=(n_dim, n_seeds, n_tests), dtype=np.float32),
+                   shift_flags=np.zeros(shape=(n_seeds, n_tests), dtype=np.uint8),
+                   detected_flags=np.zeros(shape=(n_seeds, n_tests), dtype=np.uint8),
+                   test_times=np.zeros(shape=(n_seeds, n_tests)))
+    for seed_idx, seed_result in enumerate(seed_results):
+        for result_name, seed_array in seed_result.items():
+            buffers[result_name][..., seed_idx, :] = seed_array
+    return {result_name: buffer.reshape(*buffer.shape[:-2], -1) for result_name, buffer in buffers.items()}
+
+
+if __name__ == '__main__':
+    # every run is dispatched at once, map yields them in order so each cell's seeds arrive together
+    seed_params = list(product(experiment_list, graph_type_list, mi_list, random_seed_list))
+    executor = get_reusable_executor(max_workers=n_workers)
+    # read back with fsd._utils.load_experiment_results
+    experiment_save_name = path.join(results_dir, 'unknown-multiple-sensors-results.pickle')
+    # each experiment is saved on a background thread while the runs continue
+    saving_futures = []
+    cell_results = []  # the results of each finished seed of the current cell, as dictionaries per n_compromised
+    with open(experiment_save_name, 'wb') as results_file, ThreadPoolExecutor(max_workers=1) as saving_executor:
+        for (experiment, graph_type, mi, random_seed), seed_results in \
+                zip(seed_params, executor.map(run_seed, *zip(*seed_params))):
+            cell_results.append(seed_results)
+            if len(cell_results) < len(random_seed_list):
+                continue
+            for n_compromised in n_attacked_sensors_list:
+                saving_futures.append(saving_executor.submit(
+                    save_experiment_results, experiment, graph_type, mi, n_compromised,
+                    [seed_results[n_compromised] for seed_results in cell_results], results_file))
+            cell_results = []
+    for future in saving_futures:
+        future.result()  # raises any exception which happened while saving
+    print('Fin!')